@@ -1,16 +1,375 @@
 from flask import Flask, request, jsonify
+import ast
+import functools
 import random
 import time
 import os
+import json
+import math
+import socket
+import threading
+import numpy as np
 from flask_cors import CORS  # Add CORS support
+from common.auth import check_token
+from common.profiler import profiler_blueprint
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+app.register_blueprint(profiler_blueprint)
+
+# Pod name from the downward API; inside Kubernetes the hostname is the same
+REPLICA_ID = os.environ.get('POD_NAME') or socket.gethostname()
+# With preload_app this is set once in the gunicorn master, i.e. at pod start
+STARTED_AT = time.time()
+
+
+class LatencyModel:
+    """Runtime-configurable latency and fault injection for the operations.
+
+    The config is persisted to `path` so every gunicorn worker in the pod picks
+    up changes made through /admin/latency without a restart. Each operation
+    uses the "default" spec merged with its entry in "operations":
+
+        {
+            "seed": 42,
+            "default": {"distribution": "uniform", "low": 0.01, "high": 0.1},
+            "operations": {
+                "divide": {"distribution": "lognormal", "median": 0.05, "sigma": 0.8,
+                           "mode": "cpu", "error_rate": 0.01, "stall_rate": 0.001}
+            },
+            "slow_start": {"seconds": 30, "factor": 5, "from": "start"}
+        }
+
+    Each process reseeds after fork, so workers never draw in lockstep.
+    Without a seed every process gets a fresh RNG mixing in its pid. With a
+    seed the RNG is derived from seed, REPLICA_ID and the gunicorn worker's
+    spawn index (set in post_fork), so replicas and workers inject faults at
+    different request positions; reproducing a run needs the same pod names
+    (set POD_NAME), the same number of workers, no worker restarts and the
+    same assignment of requests to workers, which the load balancer only
+    approximates.
+    Slow-start is measured from process start ("from": "start", simulating a
+    freshly restarted replica) or from when the config was applied ("apply").
+    """
+
+    OPERATIONS = ('add', 'subtract', 'multiply', 'divide', 'evaluate')
+    DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal', 'empirical')
+    DEFAULT_CONFIG = {
+        "seed": None,
+        "default": {"distribution": "uniform", "low": 0.01, "high": 0.1},
+        "operations": {},
+        "slow_start": None
+    }
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.last_check = 0.0
+        self.worker_index = 0
+        self.load(dict(self.DEFAULT_CONFIG, applied_at=time.time()))
+
+    @classmethod
+    def validate(cls, config):
+        """Return a complete config built from `config`, or raise ValueError."""
+        if not isinstance(config, dict):
+            raise ValueError("Config must be a JSON object")
+        unknown = set(config) - set(cls.DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+
+        merged = dict(cls.DEFAULT_CONFIG)
+        merged.update(config)
+        if merged['seed'] is not None:
+            merged['seed'] = int(merged['seed'])
+        if not isinstance(merged['operations'], dict):
+            raise ValueError("'operations' must be an object")
+        unknown = set(merged['operations']) - set(cls.OPERATIONS)
+        if unknown:
+            raise ValueError(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+        merged['default'] = cls.validate_spec(merged['default'], 'default')
+        merged['operations'] = {
+            op: cls.validate_spec(dict(merged['default'], **spec) if isinstance(spec, dict) else spec, op)
+            for op, spec in merged['operations'].items()
+        }
+
+        slow_start = merged['slow_start']
+        if slow_start is not None:
+            if not isinstance(slow_start, dict):
+                raise ValueError("'slow_start' must be an object")
+            seconds = cls.number(slow_start, 'seconds', 'slow_start', default=0)
+            factor = cls.number(slow_start, 'factor', 'slow_start', default=1)
+            if seconds <= 0 or factor < 1:
+                raise ValueError("'slow_start' needs seconds > 0 and factor >= 1")
+            if slow_start.get('from', 'start') not in ('start', 'apply'):
+                raise ValueError("'slow_start.from' must be 'start' or 'apply'")
+            merged['slow_start'] = {
+                "seconds": seconds,
+                "factor": factor,
+                "from": slow_start.get('from', 'start')
+            }
+        return merged
+
+    @staticmethod
+    def number(spec, key, name, default=None, minimum=0.0, maximum=math.inf):
+        """Read `key` from `spec` as a finite float within [minimum, maximum]."""
+        value = spec.get(key, default)
+        if value is None:
+            raise ValueError(f"Missing '{key}' for '{name}'")
+        value = float(value)
+        if not math.isfinite(value) or not minimum <= value <= maximum:
+            bounds = f">= {minimum:g}" if maximum == math.inf else f"between {minimum:g} and {maximum:g}"
+            raise ValueError(f"'{key}' for '{name}' must be a finite number {bounds}")
+        return value
+
+    @classmethod
+    def validate_spec(cls, spec, name):
+        if not isinstance(spec, dict):
+            raise ValueError(f"Spec for '{name}' must be an object")
+        distribution = spec.get('distribution', 'uniform')
+        if distribution not in cls.DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution for '{name}': {distribution}")
+        if spec.get('mode', 'sleep') not in ('sleep', 'cpu'):
+            raise ValueError(f"'mode' for '{name}' must be 'sleep' or 'cpu'")
+
+        if distribution == 'fixed':
+            params = {"value": cls.number(spec, 'value', name)}
+        elif distribution == 'uniform':
+            params = {"low": cls.number(spec, 'low', name), "high": cls.number(spec, 'high', name)}
+            if params['low'] > params['high']:
+                raise ValueError(f"'low' for '{name}' must not exceed 'high'")
+        elif distribution == 'lognormal':
+            params = {"median": cls.number(spec, 'median', name), "sigma": cls.number(spec, 'sigma', name)}
+            if params['median'] <= 0:
+                raise ValueError(f"'median' for '{name}' must be positive")
+        else:
+            samples = spec.get('samples')
+            if not isinstance(samples, list) or not samples:
+                raise ValueError(f"'samples' for '{name}' must be a non-empty list")
+            params = {"samples": [cls.number({'sample': s}, 'sample', name) for s in samples]}
+
+        error_status = int(spec.get('error_status', 503))
+        if not 400 <= error_status <= 599:
+            raise ValueError(f"'error_status' for '{name}' must be a 4xx or 5xx status")
+
+        return dict(
+            params,
+            distribution=distribution,
+            mode=spec.get('mode', 'sleep'),
+            max=cls.number(spec, 'max', name) if spec.get('max') is not None else None,
+            error_rate=cls.number(spec, 'error_rate', name, default=0, maximum=1),
+            error_status=error_status,
+            stall_rate=cls.number(spec, 'stall_rate', name, default=0, maximum=1),
+            stall_seconds=cls.number(spec, 'stall_seconds', name, default=2.0)
+        )
+
+    def load(self, config):
+        validated = self.validate({k: v for k, v in config.items() if k != 'applied_at'})
+        validated['applied_at'] = config['applied_at']
+        with self.lock:
+            self.config = validated
+            self.rng = self.make_rng(validated['seed'])
+
+    def make_rng(self, seed):
+        if seed is None:
+            return random.Random(f"{os.getpid()}:{os.urandom(16).hex()}")
+        return random.Random(f"{seed}:{REPLICA_ID}:{self.worker_index}")
+
+    def reseed(self, worker_index=None):
+        """Give a forked process its own RNG (and a fresh lock) instead of the parent's."""
+        if worker_index is not None:
+            self.worker_index = worker_index
+        self.lock = threading.Lock()
+        self.rng = self.make_rng(self.config['seed'])
+
+    def save(self, config):
+        """Validate, apply and persist `config` for the other workers."""
+        config = dict(self.validate(config), applied_at=time.time())
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(config, f)
+        os.replace(tmp_path, self.path)
+        self.load(config)
+        self.mtime = os.stat(self.path).st_mtime
+        return config
+
+    def reset(self):
+        return self.save({})
+
+    def refresh(self):
+        # At most one stat() per check_interval, so the hot path stays cheap
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self.mtime:
+            try:
+                with open(self.path) as f:
+                    self.load(json.load(f))
+                self.mtime = mtime
+            except (OSError, ValueError) as e:
+                app.logger.warning(f"Ignoring invalid latency config {self.path}: {e}")
+
+    def spec(self, operation):
+        return self.config['operations'].get(operation, self.config['default'])
+
+    def draw(self, spec):
+        distribution = spec['distribution']
+        if distribution == 'fixed':
+            delay = spec['value']
+        elif distribution == 'uniform':
+            delay = self.rng.uniform(spec['low'], spec['high'])
+        elif distribution == 'lognormal':
+            delay = self.rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+        else:
+            delay = self.rng.choice(spec['samples'])
+        if spec['max'] is not None:
+            delay = min(delay, spec['max'])
+        return max(delay, 0.0)
+
+    def slow_start_factor(self):
+        slow_start = self.config['slow_start']
+        if not slow_start:
+            return 1.0
+        started = STARTED_AT if slow_start['from'] == 'start' else self.config['applied_at']
+        elapsed = time.time() - started
+        if elapsed >= slow_start['seconds']:
+            return 1.0
+        # Decays linearly from `factor` to 1 over the warm-up window
+        return 1.0 + (slow_start['factor'] - 1.0) * (1.0 - elapsed / slow_start['seconds'])
+
+    @staticmethod
+    def burn_cpu(seconds):
+        deadline = time.thread_time() + seconds
+        x = 0
+        while time.thread_time() < deadline:
+            for i in range(1000):
+                x += i * i
+        return x
+
+    def apply(self, operation):
+        """Delay the current request; returns an error response to inject, or None."""
+        self.refresh()
+        spec = self.spec(operation)
+        with self.lock:
+            delay = self.draw(spec) * self.slow_start_factor()
+            stall = self.rng.random() < spec['stall_rate']
+            fail = self.rng.random() < spec['error_rate']
+
+        if spec['mode'] == 'cpu':
+            self.burn_cpu(delay)
+        else:
+            time.sleep(delay)
+        if stall:
+            time.sleep(spec['stall_seconds'])
+        if fail:
+            return jsonify({"error": f"Injected fault in {operation}"}), spec['error_status']
+        return None
+
+
+latency_model = LatencyModel(os.environ.get('LATENCY_CONFIG_PATH', '/tmp/calculator-latency.json'))
+# gunicorn preloads the app in the master, so workers would inherit its RNG state
+os.register_at_fork(after_in_child=latency_model.reseed)
+
+
+class CompiledExpression:
+    """An arithmetic expression compiled to a postfix plan over named variables.
+
+    Only numbers, variables, parentheses and + - * / % ** are accepted; the
+    expression is parsed with ast and checked node by node, never eval'd.
+    evaluate() runs the plan once over whole columns of bindings.
+    """
+
+    MAX_LENGTH = 1000
+    BINARY_OPS = {
+        ast.Add: np.add,
+        ast.Sub: np.subtract,
+        ast.Mult: np.multiply,
+        ast.Div: np.true_divide,
+        ast.Mod: np.mod,
+        ast.Pow: np.power
+    }
+    UNARY_OPS = {
+        ast.USub: np.negative,
+        ast.UAdd: np.positive
+    }
+
+    def __init__(self, expression):
+        if len(expression) > self.MAX_LENGTH:
+            raise ValueError(f"Expression longer than {self.MAX_LENGTH} characters")
+        self.expression = expression
+        self.steps = []
+        variables = set()
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+            self.compile(tree.body, variables)
+        except (SyntaxError, RecursionError, OverflowError) as e:
+            raise ValueError(f"Invalid expression: {e}")
+        self.variables = tuple(sorted(variables))
+
+    def compile(self, node, variables):
+        if isinstance(node, ast.BinOp) and type(node.op) in self.BINARY_OPS:
+            self.compile(node.left, variables)
+            self.compile(node.right, variables)
+            self.steps.append(('binary', self.BINARY_OPS[type(node.op)]))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self.UNARY_OPS:
+            self.compile(node.operand, variables)
+            self.steps.append(('unary', self.UNARY_OPS[type(node.op)]))
+        elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            self.steps.append(('const', float(node.value)))
+        elif isinstance(node, ast.Name):
+            variables.add(node.id)
+            self.steps.append(('var', node.id))
+        else:
+            raise ValueError(f"Unsupported syntax in expression: {type(node).__name__}")
+
+    def evaluate(self, columns):
+        """Evaluate over `columns` (variable name -> 1-D float array), all of one length."""
+        stack = []
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for kind, arg in self.steps:
+                if kind == 'const':
+                    stack.append(arg)
+                elif kind == 'var':
+                    stack.append(columns[arg])
+                elif kind == 'unary':
+                    stack.append(arg(stack.pop()))
+                else:
+                    right = stack.pop()
+                    stack.append(arg(stack.pop(), right))
+        return stack.pop()
+
+
+MAX_BINDINGS = 10000
+
+
+@functools.lru_cache(maxsize=int(os.environ.get('EXPRESSION_CACHE_SIZE', 256)))
+def compile_expression(expression):
+    # Keyed by the exact expression text, so repeated formulas skip parsing
+    return CompiledExpression(expression)
+
+
+@app.after_request
+def tag_replica(response):
+    # Lets clients attribute load and latency to the pod that served them
+    response.headers['X-Calculator-Replica'] = REPLICA_ID
+    return response
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "calculator"})
+    return jsonify({
+        "status": "healthy",
+        "service": "calculator",
+        "replica": REPLICA_ID,
+        "expression_cache": compile_expression.cache_info()._asdict()
+    })
 
 
 @app.route('/add', methods=['POST'])
@@ -21,7 +380,10 @@ def add():
             return jsonify({"error": "No JSON data provided"}), 400
 
         # Simulate some processing time
-        time.sleep(random.uniform(0.01, 0.1))
+        fault = latency_model.apply('add')
+        if fault:
+            return fault
+
         result = float(data['a']) + float(data['b'])
         return jsonify({
             "operation": "add",
@@ -40,7 +402,9 @@ def subtract():
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
-        time.sleep(random.uniform(0.01, 0.1))
+        fault = latency_model.apply('subtract')
+        if fault:
+            return fault
         result = float(data['a']) - float(data['b'])
         return jsonify({
             "operation": "subtract",
@@ -59,7 +423,9 @@ def multiply():
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
-        time.sleep(random.uniform(0.01, 0.1))
+        fault = latency_model.apply('multiply')
+        if fault:
+            return fault
         result = float(data['a']) * float(data['b'])
         return jsonify({
             "operation": "multiply",
@@ -78,7 +444,9 @@ def divide():
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
-        time.sleep(random.uniform(0.01, 0.1))
+        fault = latency_model.apply('divide')
+        if fault:
+            return fault
         b = float(data['b'])
         if b == 0:
             return jsonify({"error": "Division by zero"}), 400
@@ -94,5 +462,87 @@ def divide():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+        if not isinstance(data.get('expression'), str):
+            return jsonify({"error": "'expression' must be a string"}), 400
+
+        # Either one set of variables or a list of bindings evaluated in one pass
+        single = 'bindings' not in data
+        bindings = [data.get('variables', {})] if single else data['bindings']
+        if not isinstance(bindings, list) or not bindings:
+            return jsonify({"error": "'bindings' must be a non-empty list"}), 400
+        if len(bindings) > MAX_BINDINGS:
+            return jsonify({"error": f"At most {MAX_BINDINGS} bindings per request"}), 400
+
+        try:
+            plan = compile_expression(data['expression'])
+            columns = {
+                name: np.array([float(binding[name]) for binding in bindings], dtype=float)
+                for name in plan.variables
+            }
+        except KeyError as e:
+            return jsonify({"error": f"Missing variable {e}"}), 400
+        except (TypeError, ValueError, OverflowError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        fault = latency_model.apply('evaluate')
+        if fault:
+            return fault
+
+        values = np.broadcast_to(plan.evaluate(columns), (len(bindings),))
+        finite = np.isfinite(values)
+        # Division by zero and overflow give inf/nan; report them like /divide does
+        results = [value if ok else None for value, ok in zip(values.tolist(), finite.tolist())]
+        errors = [
+            {"index": i, "error": "Division by zero or non-finite result"}
+            for i, ok in enumerate(finite.tolist()) if not ok
+        ]
+
+        if single:
+            if errors:
+                return jsonify({"error": errors[0]['error'], "expression": data['expression']}), 400
+            return jsonify({
+                "operation": "evaluate",
+                "expression": data['expression'],
+                "result": results[0],
+                "variables": bindings[0]
+            })
+        return jsonify({
+            "operation": "evaluate",
+            "expression": data['expression'],
+            "results": results,
+            "errors": errors
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/latency', methods=['GET', 'PUT', 'DELETE'])
+def admin_latency():
+    denied = check_token('ADMIN_TOKEN', 'X-Admin-Token')
+    if denied:
+        return denied
+
+    try:
+        if request.method == 'PUT':
+            data = request.get_json()
+            if data is None:
+                return jsonify({"error": "No JSON data provided"}), 400
+            return jsonify(latency_model.save(data))
+        if request.method == 'DELETE':
+            return jsonify(latency_model.reset())
+        latency_model.refresh()
+        return jsonify(latency_model.config)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Gunicorn settings for the calculator service, sized from the container's
+cgroup limits.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+Sizing can be overridden from the environment (WEB_CONCURRENCY,
+GUNICORN_THREADS, WORKER_MEMORY_MB); GRACEFUL_TIMEOUT and PORT as well.
+"""
+import os
+
+from common.sizing import worker_count, thread_count
+
+# Flask, flask_cors and numpy come to roughly 80 MB resident per worker
+workers = worker_count(worker_memory_mb=80)
+
+# With the default latency model handlers sleep, so each thread is one more
+# request in flight rather than more CPU: 32 threads keep a single small worker
+# serving through injected stalls or a running /debug/profile. Lower
+# GUNICORN_THREADS when the model uses "mode": "cpu", since CPU-burning
+# handlers only contend for the GIL
+threads = thread_count(default=32)
+worker_class = 'gthread'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Import the app once in the master so workers share its pages after fork
+preload_app = True
+
+# On SIGTERM stop accepting, let in-flight requests finish, then exit
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 25))
+timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Seeded latency models derive their RNG from the worker's spawn index
+    from app import latency_model
+    latency_model.reseed(worker.age)
@@ -0,0 +1 @@
+"""Code shared by the calculator, GUI and load simulator images."""
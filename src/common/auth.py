@@ -0,0 +1,17 @@
+import hmac
+import os
+
+from flask import request, jsonify
+
+
+def check_token(env_var, header):
+    """Return an error response unless `header` carries the token in `env_var`.
+
+    Endpoints guarded this way are disabled (404) while no token is configured.
+    """
+    token = os.environ.get(env_var)
+    if not token:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get(header, ''), token):
+        return jsonify({"error": "Forbidden"}), 403
+    return None
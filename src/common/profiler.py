@@ -0,0 +1,132 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Blueprint, request, jsonify
+
+from common.auth import check_token
+
+
+class SamplingProfiler:
+    """Stack-sampling profiler that only runs while a profile is requested.
+
+    Every `interval` seconds the frames of the other threads are captured with
+    sys._current_frames() and folded into collapsed stacks, so nothing is
+    hooked into the interpreter and there is no cost while it is idle. By
+    default only threads currently inside the Flask app are sampled, which
+    leaves out idle pool threads and the server's accept/select loop.
+
+    Only the process serving the request is sampled: under gunicorn that is
+    one worker, identified by "pid" in the result. Repeat the request to
+    profile other workers.
+    """
+
+    def __init__(self, max_seconds=60, min_interval=0.001):
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self, stacks, own_ident, all_threads):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            in_app = False
+            while frame is not None:
+                code = frame.f_code
+                if code.co_name == 'wsgi_app' and os.path.basename(code.co_filename) == 'app.py':
+                    in_app = True
+                labels.append(self.frame_label(frame))
+                frame = frame.f_back
+            if in_app or all_threads:
+                labels.reverse()
+                stacks[tuple(labels)] += 1
+
+    def run(self, seconds, interval, all_threads=False):
+        """Sample for `seconds`; returns None if a profile is already running."""
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            raise ValueError("seconds and interval must be finite numbers")
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            interval = min(max(interval, self.min_interval), seconds)
+            own_ident = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                self.sample(stacks, own_ident, all_threads)
+                samples += 1
+                time.sleep(min(interval, max(deadline - time.perf_counter(), 0)))
+        finally:
+            self.lock.release()
+        return self.summarize(stacks, samples, seconds, interval)
+
+    @staticmethod
+    def summarize(stacks, samples, seconds, interval, top_n=25):
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in stacks.items():
+            self_counts[stack[-1]] += count
+            for label in set(stack):
+                total_counts[label] += count
+
+        thread_samples = sum(stacks.values()) or 1
+        top = [
+            {
+                "function": label,
+                "self": self_counts[label],
+                "total": count,
+                "self_pct": round(100.0 * self_counts[label] / thread_samples, 2),
+                "total_pct": round(100.0 * count / thread_samples, 2)
+            }
+            for label, count in sorted(total_counts.items(),
+                                       key=lambda item: (self_counts[item[0]], item[1]),
+                                       reverse=True)[:top_n]
+        ]
+        collapsed = "\n".join(
+            f"{';'.join(stack)} {count}"
+            for stack, count in stacks.most_common()
+        )
+        return {
+            "pid": os.getpid(),
+            "seconds": seconds,
+            "interval": interval,
+            "samples": samples,
+            "thread_samples": sum(stacks.values()),
+            "collapsed": collapsed,
+            "top": top
+        }
+
+
+profiler = SamplingProfiler()
+profiler_blueprint = Blueprint('profiler', __name__)
+
+
+@profiler_blueprint.route('/debug/profile', methods=['GET'])
+def profile():
+    denied = check_token('PROFILER_TOKEN', 'X-Profiler-Token')
+    if denied:
+        return denied
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+        result = profiler.run(seconds, interval, request.args.get('threads') == 'all')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "A profile is already running"}), 409
+
+    if request.args.get('format') == 'collapsed':
+        return result['collapsed'] + "\n", 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(result)
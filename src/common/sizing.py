@@ -0,0 +1,71 @@
+"""Size gunicorn from the container's cgroup limits (v1 or v2)."""
+import math
+import os
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """CPU quota in cores, or None when the container is not limited."""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = read_file('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and period:
+            return int(quota) / int(period)
+        return None
+
+    # cgroup v1: quota of -1 means unlimited
+    quota = read_file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_file('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit():
+    """Memory limit in bytes, or None when the container is not limited."""
+    limit = read_file('/sys/fs/cgroup/memory.max') or read_file('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    if not limit or limit == 'max':
+        return None
+    limit = int(limit)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    if limit >= 1 << 60:
+        return None
+    return limit
+
+
+def cpu_limit():
+    """Cores available to the container: the cgroup quota, else the host's CPUs."""
+    return cgroup_cpu_limit() or os.cpu_count() or 1
+
+
+def worker_count(worker_memory_mb):
+    """One worker per core of quota, capped by how many fit in the memory limit.
+
+    WEB_CONCURRENCY overrides the result and WORKER_MEMORY_MB the per-worker
+    estimate.
+    """
+    if 'WEB_CONCURRENCY' in os.environ:
+        return int(os.environ['WEB_CONCURRENCY'])
+    workers = max(1, math.ceil(cpu_limit()))
+    memory_limit = cgroup_memory_limit()
+    if memory_limit:
+        worker_memory = int(os.environ.get('WORKER_MEMORY_MB', worker_memory_mb)) * 1024 * 1024
+        workers = max(1, min(workers, memory_limit // worker_memory))
+    return workers
+
+
+def thread_count(default):
+    """Threads per worker; GUNICORN_THREADS overrides the service's default.
+
+    Not derived from the CPU quota: threads blocked in sleeps or HTTP calls do
+    not use CPU, so the right count depends on how long handlers block.
+    """
+    return int(os.environ.get('GUNICORN_THREADS', default))
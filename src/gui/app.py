@@ -4,8 +4,13 @@ import threading
 import json
 from datetime import datetime
 import time
+import os
+import math
+from common.auth import check_token
+from common.profiler import profiler_blueprint
 
 app = Flask(__name__)
+app.register_blueprint(profiler_blueprint)
 
 
 class CalculatorWebGUI:
@@ -28,6 +33,98 @@ class CalculatorWebGUI:
 calculator_gui = CalculatorWebGUI()
 
 
+class TrafficCapture:
+    """Records /calculate requests so the load simulator can replay them.
+
+    Requests are appended as "time,operation,a,b" lines to a file so that all
+    gunicorn workers write to the same capture; it is active while the
+    `<path>.active` marker exists and stops by itself once the file reaches
+    `max_bytes` (about 40 bytes per request).
+    """
+
+    OPERATIONS = ('add', 'subtract', 'multiply', 'divide')
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.marker = f"{path}.active"
+        self.max_bytes = max_bytes
+
+    def is_active(self):
+        return os.path.exists(self.marker)
+
+    def start(self):
+        started_at = time.time()
+        with open(self.path, 'w') as f:
+            f.write(f"{started_at!r}\n")
+        open(self.marker, 'w').close()
+        return started_at
+
+    def stop(self):
+        try:
+            os.remove(self.marker)
+        except FileNotFoundError:
+            pass
+
+    def record(self, operation, a, b):
+        if operation not in self.OPERATIONS or not self.is_active():
+            return
+        try:
+            a, b = float(a), float(b)
+        except (TypeError, ValueError):
+            return
+        if not (math.isfinite(a) and math.isfinite(b)):
+            return
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self.stop()
+                return
+        except FileNotFoundError:
+            return
+        # A single short append is atomic, so workers do not interleave lines
+        with open(self.path, 'a') as f:
+            f.write(f"{time.time()!r},{operation},{a!r},{b!r}\n")
+
+    def export(self):
+        """Return the capture as columns with offsets relative to its start.
+
+        Malformed lines, including one another worker is still writing, are
+        skipped and counted in "skipped"; only an unreadable header yields an
+        empty capture.
+        """
+        capture = {"active": self.is_active(), "offsets": [], "operations": [], "a": [], "b": [], "skipped": 0}
+        try:
+            capture['full'] = os.path.getsize(self.path) >= self.max_bytes
+            with open(self.path) as f:
+                try:
+                    started_at = float(f.readline())
+                except ValueError:
+                    return capture
+                for line in f:
+                    try:
+                        if not line.endswith('\n'):
+                            raise ValueError("incomplete line")
+                        timestamp, operation, a, b = line[:-1].split(',')
+                        offset, a, b = float(timestamp) - started_at, float(a), float(b)
+                        if operation not in self.OPERATIONS or not all(map(math.isfinite, (offset, a, b))):
+                            raise ValueError("invalid entry")
+                    except ValueError:
+                        capture['skipped'] += 1
+                        continue
+                    capture['offsets'].append(round(offset, 6))
+                    capture['operations'].append(operation)
+                    capture['a'].append(a)
+                    capture['b'].append(b)
+        except FileNotFoundError:
+            pass
+        return capture
+
+
+traffic_capture = TrafficCapture(
+    os.environ.get('CAPTURE_PATH', '/tmp/gui-capture.csv'),
+    int(os.environ.get('CAPTURE_MAX_BYTES', 8 * 1024 * 1024))
+)
+
+
 @app.route('/')
 def index():
     return '''
@@ -46,10 +143,13 @@ def index():
             input[type="number"] { padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
             .metrics-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }
             .chart-container { position: relative; height: 300px; }
-            .current-stats { display: grid; grid-template-columns: repeat(4, 1fr); gap: 10px; margin-bottom: 20px; }
+            .current-stats { display: grid; grid-template-columns: repeat(5, 1fr); gap: 10px; margin-bottom: 20px; }
             .stat-card { background: #f8f9fa; padding: 15px; border-radius: 6px; text-align: center; }
             .stat-value { font-size: 24px; font-weight: bold; color: #007cba; }
             .stat-label { font-size: 12px; color: #666; text-transform: uppercase; }
+            .replica-table { width: 100%; border-collapse: collapse; font-size: 14px; }
+            .replica-table th, .replica-table td { padding: 6px 10px; border-bottom: 1px solid #eee; text-align: right; }
+            .replica-table th:first-child, .replica-table td:first-child { text-align: left; }
             .debug-info { background: #fff3cd; padding: 10px; border-radius: 4px; margin: 10px 0; font-family: monospace; }
         </style>
     </head>
@@ -86,6 +186,15 @@ def index():
                     <input type="range" id="userSlider" min="1" max="100" value="10" oninput="updateUserCount(this.value)" style="flex: 1;">
                     <button onclick="updateLoad()" style="padding: 10px 20px;">Update Load</button>
                 </div>
+                <div style="display: flex; align-items: center; gap: 15px; margin-top: 10px;">
+                    <input type="password" id="adminToken" placeholder="Admin token" style="width: 120px;">
+                    <button onclick="captureControl('start')">⏺️ Start Capture</button>
+                    <button onclick="captureControl('stop')">⏹️ Stop Capture</button>
+                    <label><strong>Replay Speed:</strong> <input type="number" id="replaySpeed" value="1" min="0.1" step="0.1" style="width: 70px;"></label>
+                    <label><input type="checkbox" id="replayLoop"> Loop</label>
+                    <button onclick="replayCapture()">🔁 Replay Capture</button>
+                    <span id="captureStatus"></span>
+                </div>
             </div>
 
             <div class="section">
@@ -107,6 +216,10 @@ def index():
                         <div class="stat-value">0</div>
                         <div class="stat-label">Avg Response Time (ms)</div>
                     </div>
+                    <div class="stat-card">
+                        <div class="stat-value">0</div>
+                        <div class="stat-label">Replica Imbalance</div>
+                    </div>
                 </div>
             </div>
 
@@ -125,10 +238,30 @@ def index():
                     </div>
                 </div>
             </div>
+
+            <div class="section">
+                <h2>🧩 Load per Calculator Replica</h2>
+                <div class="metrics-grid">
+                    <div>
+                        <div class="chart-container">
+                            <canvas id="replicasChart"></canvas>
+                        </div>
+                    </div>
+                    <div>
+                        <table class="replica-table">
+                            <thead>
+                                <tr><th>Replica</th><th>Requests</th><th>Errors</th><th>p50 (ms)</th><th>p95 (ms)</th><th>p99 (ms)</th></tr>
+                            </thead>
+                            <tbody id="replicaTable"></tbody>
+                        </table>
+                    </div>
+                </div>
+            </div>
         </div>
 
         <script>
-            let operationsChart, usersChart;
+            let operationsChart, usersChart, replicasChart;
+            const replicaColors = ['#4CAF50', '#2196F3', '#FF9800', '#F44336', '#9C27B0', '#00BCD4', '#795548', '#607D8B'];
             let chartData = {
                 timestamps: [],
                 operations: { add: [], subtract: [], multiply: [], divide: [] },
@@ -212,6 +345,39 @@ def index():
                 });
             }
 
+            function captureControl(action) {
+                fetch(`/capture/${action}`, {
+                    method: 'POST',
+                    headers: {'X-Admin-Token': document.getElementById('adminToken').value}
+                })
+                .then(response => response.json())
+                .then(data => {
+                    document.getElementById('captureStatus').textContent = data.error ? `Error: ${data.error}` :
+                        (action === 'start' ? 'Capturing /calculate requests...' : `Captured ${data.requests} requests`);
+                })
+                .catch(error => console.error('Capture error:', error));
+            }
+
+            function replayCapture() {
+                fetch('/replay', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-Admin-Token': document.getElementById('adminToken').value
+                    },
+                    body: JSON.stringify({
+                        speed: parseFloat(document.getElementById('replaySpeed').value) || 1,
+                        loop: document.getElementById('replayLoop').checked
+                    })
+                })
+                .then(response => response.json())
+                .then(data => {
+                    document.getElementById('captureStatus').textContent = data.error ? `Error: ${data.error}` :
+                        `Replaying ${data.plan.requests} requests at ${data.plan.speed}x`;
+                })
+                .catch(error => console.error('Replay error:', error));
+            }
+
             function initializeCharts() {
                 const ctx1 = document.getElementById('operationsChart').getContext('2d');
                 operationsChart = new Chart(ctx1, {
@@ -308,6 +474,43 @@ def index():
                         }
                     }
                 });
+
+                const ctx3 = document.getElementById('replicasChart').getContext('2d');
+                replicasChart = new Chart(ctx3, {
+                    type: 'line',
+                    data: {
+                        labels: [],
+                        datasets: []
+                    },
+                    options: {
+                        responsive: true,
+                        maintainAspectRatio: false,
+                        scales: {
+                            y: {
+                                beginAtZero: true,
+                                title: {
+                                    display: true,
+                                    text: 'Requests per Interval'
+                                }
+                            },
+                            imbalance: {
+                                position: 'right',
+                                beginAtZero: true,
+                                grid: { drawOnChartArea: false },
+                                title: {
+                                    display: true,
+                                    text: 'Imbalance (CV)'
+                                }
+                            }
+                        },
+                        plugins: {
+                            title: {
+                                display: true,
+                                text: 'Requests per Replica Over Time'
+                            }
+                        }
+                    }
+                });
             }
 
             function updateCurrentStats(metrics) {
@@ -333,8 +536,22 @@ def index():
                                 current.response_times.reduce((a, b) => a + b, 0) / current.response_times.length * 1000 : 0))}</div>
                             <div class="stat-label">Avg Response Time (ms)</div>
                         </div>
+                        <div class="stat-card">
+                            <div class="stat-value">${(current.replica_imbalance || 0).toFixed(2)}</div>
+                            <div class="stat-label">Replica Imbalance</div>
+                        </div>
                     `;
                 }
+
+                const table = document.getElementById('replicaTable');
+                if (table) {
+                    const replicas = current.replicas || {};
+                    table.innerHTML = Object.keys(replicas).sort().map(name => {
+                        const r = replicas[name];
+                        return `<tr><td>${name}</td><td>${r.requests}</td><td>${r.errors}</td>` +
+                            `<td>${r.latency_ms.p50}</td><td>${r.latency_ms.p95}</td><td>${r.latency_ms.p99}</td></tr>`;
+                    }).join('');
+                }
             }
 
             function updateCharts(metrics) {
@@ -361,6 +578,29 @@ def index():
                     usersChart.data.datasets[0].data = historical.active_users;
                     usersChart.update();
                 }
+
+                // Update per-replica chart
+                if (replicasChart && historical.replica_counts) {
+                    const names = Object.keys(historical.replica_counts).sort();
+                    replicasChart.data.labels = historical.timestamps;
+                    replicasChart.data.datasets = names.map((name, i) => ({
+                        label: name,
+                        data: historical.replica_counts[name],
+                        borderColor: replicaColors[i % replicaColors.length],
+                        tension: 0.4,
+                        borderWidth: 2
+                    }));
+                    replicasChart.data.datasets.push({
+                        label: 'Imbalance',
+                        data: historical.replica_imbalance || [],
+                        borderColor: '#000000',
+                        borderDash: [5, 5],
+                        yAxisID: 'imbalance',
+                        tension: 0.4,
+                        borderWidth: 1
+                    });
+                    replicasChart.update();
+                }
             }
 
             async function updateMetrics() {
@@ -379,7 +619,9 @@ def index():
                         historical: {
                             timestamps: [],
                             operation_counts: { add: [], subtract: [], multiply: [], divide: [] },
-                            active_users: []
+                            active_users: [],
+                            replica_counts: {},
+                            replica_imbalance: []
                         }
                     });
                 }
@@ -405,6 +647,7 @@ def calculate():
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
+        traffic_capture.record(data['operation'], data['a'], data['b'])
         result = calculator_gui.calculate(data['operation'], data['a'], data['b'])
         return jsonify(result)
     except Exception as e:
@@ -425,6 +668,62 @@ def update_load():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/capture', methods=['GET'])
+def get_capture():
+    denied = check_token('ADMIN_TOKEN', 'X-Admin-Token')
+    if denied:
+        return denied
+    return jsonify(traffic_capture.export())
+
+
+@app.route('/capture/start', methods=['POST'])
+def start_capture():
+    denied = check_token('ADMIN_TOKEN', 'X-Admin-Token')
+    if denied:
+        return denied
+
+    try:
+        started_at = traffic_capture.start()
+        return jsonify({"message": "Capture started", "started_at": started_at})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/capture/stop', methods=['POST'])
+def stop_capture():
+    denied = check_token('ADMIN_TOKEN', 'X-Admin-Token')
+    if denied:
+        return denied
+
+    try:
+        traffic_capture.stop()
+        return jsonify({"message": "Capture stopped", "requests": len(traffic_capture.export()['offsets'])})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/replay', methods=['POST'])
+def replay():
+    denied = check_token('ADMIN_TOKEN', 'X-Admin-Token')
+    if denied:
+        return denied
+
+    try:
+        data = request.get_json(silent=True) or {}
+        response = requests.post(
+            "http://load-simulator-service:8080/replay",
+            json={
+                "speed": data.get('speed', 1.0),
+                "loop": data.get('loop', False),
+                "capture": traffic_capture.export()
+            },
+            timeout=10
+        )
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/metrics')
 def get_metrics():
     try:
@@ -438,13 +737,17 @@ def get_metrics():
                 "active_users": 0,
                 "total_requests": 0,
                 "error_count": 0,
-                "response_times": []
+                "response_times": [],
+                "replicas": {},
+                "replica_imbalance": 0
             },
             "historical": {
                 "timestamps": [],
                 "operation_counts": {"add": [], "subtract": [], "multiply": [], "divide": []},
                 "active_users": [],
-                "response_times": []
+                "response_times": [],
+                "replica_counts": {},
+                "replica_imbalance": []
             }
         })
 
@@ -0,0 +1,33 @@
+"""Gunicorn settings for the GUI service, sized from the container's
+cgroup limits.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+Sizing can be overridden from the environment (WEB_CONCURRENCY,
+GUNICORN_THREADS, WORKER_MEMORY_MB); GRACEFUL_TIMEOUT and PORT as well.
+"""
+import os
+
+from common.sizing import worker_count, thread_count
+
+# Flask and requests come to roughly 64 MB resident per worker
+workers = worker_count(worker_memory_mb=64)
+
+# Requests are proxied to the calculator and load simulator with timeouts of
+# up to 10 s, so handlers mostly block on HTTP; size threads for the requests
+# in flight, not for the CPU quota
+threads = thread_count(default=32)
+worker_class = 'gthread'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+
+# Import the app once in the master so workers share its pages after fork
+preload_app = True
+
+# On SIGTERM stop accepting, let in-flight requests finish, then exit
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 25))
+timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
@@ -2,7 +2,11 @@ from flask import Flask, request, jsonify
 import threading
 import time
 import random
+import os
 import requests
+import statistics
+import math
+import numpy as np
 from collections import deque
 import logging
 
@@ -13,6 +17,94 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 
+OPERATIONS = ['add', 'subtract', 'multiply', 'divide']
+
+# One planned request: send offset (seconds from the start of the run), index
+# into OPERATIONS and the two operands, ~25 bytes per request
+PLAN_DTYPE = np.dtype([('offset', 'f8'), ('op', 'u1'), ('a', 'f8'), ('b', 'f8')])
+
+
+def generate_plan(seed, user_id, block_size=512, think_time=(1.0, 3.0), operand_range=(1, 100)):
+    """Yield blocks of planned requests for one user, forever.
+
+    Each block is drawn in a single vectorized pass from a generator seeded
+    with (seed, user_id), so a user's workload only depends on the seed and
+    adding users does not change what the existing ones send.
+    """
+    rng = np.random.default_rng([seed, user_id])
+    low, high = operand_range
+    offset = 0.0
+    while True:
+        block = np.empty(block_size, dtype=PLAN_DTYPE)
+        block['offset'] = offset + np.cumsum(rng.uniform(think_time[0], think_time[1], block_size))
+        block['op'] = rng.integers(0, len(OPERATIONS), block_size)
+        block['a'] = rng.integers(low, high, block_size, endpoint=True)
+        block['b'] = rng.integers(low, high, block_size, endpoint=True)
+        offset = float(block['offset'][-1])
+        yield block
+
+
+def parse_seed(value):
+    """Validate a plan seed: None (draw one per run) or an integer in [0, 2**32)."""
+    if value is None:
+        return None
+    seed = int(value)
+    if not 0 <= seed < 2 ** 32:
+        raise ValueError("seed must be between 0 and 2**32 - 1")
+    return seed
+
+
+def parse_speed(value):
+    speed = float(value)
+    if not math.isfinite(speed) or speed <= 0:
+        raise ValueError("speed must be a finite number greater than 0")
+    return speed
+
+
+def capture_to_plan(capture, speed=1.0):
+    """Build a plan from a GUI capture ({"offsets", "operations", "a", "b"} columns)."""
+    speed = parse_speed(speed)
+    if not isinstance(capture, dict):
+        raise ValueError("Capture must be an object")
+    offsets = capture['offsets']
+    columns = (capture['operations'], capture['a'], capture['b'])
+    if any(len(column) != len(offsets) for column in columns):
+        raise ValueError("Capture columns must all have the same length")
+
+    unknown = set(capture['operations']) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations in capture: {', '.join(sorted(unknown))}")
+
+    plan = np.empty(len(offsets), dtype=PLAN_DTYPE)
+    plan['offset'] = np.asarray(offsets, dtype='f8') / speed
+    plan['op'] = [OPERATIONS.index(op) for op in capture['operations']]
+    plan['a'] = capture['a']
+    plan['b'] = capture['b']
+    if not all(np.isfinite(plan[column]).all() for column in ('offset', 'a', 'b')) or (plan['offset'] < 0).any():
+        raise ValueError("Capture offsets and operands must be finite, offsets non-negative")
+    return np.sort(plan, order='offset')
+
+
+def replay_plan(plan, user_id, user_count, loop=False):
+    """Yield the share of `plan` that one of `user_count` users sends.
+
+    Requests are dealt round-robin so the users together keep the recorded
+    schedule; with `loop` the plan restarts after its last request.
+    """
+    share = plan[user_id::user_count]
+    if not len(share):
+        return
+    duration = float(plan['offset'][-1]) if len(plan) else 0.0
+    shift = 0.0
+    while True:
+        block = share.copy()
+        block['offset'] += shift
+        yield block
+        if not loop:
+            return
+        shift += max(duration, 1.0)
+
+
 class TimeSeriesMetrics:
     def __init__(self, max_points=30):  # Reduced to 30 points for stability
         self.max_points = max_points
@@ -24,8 +116,10 @@ class TimeSeriesMetrics:
             'divide': deque(maxlen=max_points)
         }
         self.active_users = deque(maxlen=max_points)
+        self.replica_counts = {}
+        self.replica_imbalance = deque(maxlen=max_points)
 
-    def add_data_point(self, operation_counts, active_users):
+    def add_data_point(self, operation_counts, active_users, replica_counts=None):
         current_time = time.time()
         self.timestamps.append(current_time)
 
@@ -34,6 +128,25 @@ class TimeSeriesMetrics:
 
         self.active_users.append(active_users)
 
+        replica_counts = replica_counts or {}
+        for replica in replica_counts:
+            if replica not in self.replica_counts:
+                # Pad new replicas with zeros so every series lines up with the timestamps
+                padding = [0] * (len(self.timestamps) - 1)
+                self.replica_counts[replica] = deque(padding, maxlen=self.max_points)
+        for replica, counts in list(self.replica_counts.items()):
+            counts.append(replica_counts.get(replica, 0))
+            # Forget replicas that served nothing in the whole window (e.g. replaced pods)
+            if not any(counts):
+                del self.replica_counts[replica]
+        self.replica_imbalance.append(
+            imbalance_score([counts[-1] for counts in self.replica_counts.values()])
+        )
+
+    def window_imbalance(self):
+        """Imbalance of the requests each live replica served over the whole window."""
+        return imbalance_score([sum(counts) for counts in self.replica_counts.values()])
+
     def get_historical_data(self):
         # Format timestamps for display
         formatted_timestamps = [time.strftime('%H:%M:%S', time.localtime(ts)) for ts in self.timestamps]
@@ -41,25 +154,113 @@ class TimeSeriesMetrics:
         return {
             'timestamps': formatted_timestamps,
             'operation_counts': {op: list(counts) for op, counts in self.operation_counts.items()},
-            'active_users': list(self.active_users)
+            'active_users': list(self.active_users),
+            'replica_counts': {replica: list(counts) for replica, counts in self.replica_counts.items()},
+            'replica_imbalance': list(self.replica_imbalance)
         }
 
 
+def imbalance_score(counts):
+    """Coefficient of variation of per-replica request counts (0 = perfectly even)."""
+    if len(counts) < 2 or not sum(counts):
+        return 0.0
+    return round(statistics.pstdev(counts) / statistics.mean(counts), 3)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ReplicaMetrics:
+    """Request counts, errors and recent latencies per calculator replica.
+
+    Replicas are identified by the X-Calculator-Replica response header;
+    requests that never got a response are counted under "unknown". Replicas
+    not seen for `window` seconds (e.g. replaced pods) are dropped.
+    """
+
+    def __init__(self, max_samples=1000, window=60):
+        self.max_samples = max_samples
+        self.window = window
+        self.lock = threading.Lock()
+        self.replicas = {}
+        self.interval_counts = {}
+
+    def record(self, replica, latency, error):
+        with self.lock:
+            stats = self.replicas.get(replica)
+            if stats is None:
+                stats = {'requests': 0, 'errors': 0, 'latencies': deque(maxlen=self.max_samples)}
+                self.replicas[replica] = stats
+            stats['requests'] += 1
+            stats['last_seen'] = time.time()
+            self.interval_counts[replica] = self.interval_counts.get(replica, 0) + 1
+            if error:
+                stats['errors'] += 1
+            if latency is not None:
+                stats['latencies'].append(latency)
+
+    def take_interval_counts(self):
+        """Return requests per replica since the last call and start a new interval."""
+        with self.lock:
+            counts = self.interval_counts
+            self.interval_counts = {}
+        return counts
+
+    def snapshot(self):
+        with self.lock:
+            cutoff = time.time() - self.window
+            for replica in [r for r, stats in self.replicas.items() if stats['last_seen'] < cutoff]:
+                del self.replicas[replica]
+            replicas = {
+                replica: (stats['requests'], stats['errors'], sorted(stats['latencies']))
+                for replica, stats in self.replicas.items()
+            }
+
+        result = {}
+        for replica, (requests_count, errors, latencies) in replicas.items():
+            result[replica] = {
+                'requests': requests_count,
+                'errors': errors,
+                'latency_ms': {
+                    'p50': round(percentile(latencies, 50) * 1000, 1),
+                    'p95': round(percentile(latencies, 95) * 1000, 1),
+                    'p99': round(percentile(latencies, 99) * 1000, 1),
+                    'mean': round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0
+                }
+            }
+        return result
+
+
 class LoadSimulator:
     def __init__(self):
         self.active_users = 5  # Start with fewer users
         self.is_running = False
         self.threads = []
+        # Bumped on every start so threads from a previous run exit promptly
+        self.run_id = 0
+        self.seed = None  # None draws a fresh seed for every run
+        self.run_seed = None
+        self.replay = None  # {"plan", "speed", "loop"} while replaying a capture
+        # Planned requests overdue by more than this are skipped, not sent late
+        self.max_lag = 1.0
         self.metrics = {
             'current': {
                 'request_rates': {'add': 0, 'subtract': 0, 'multiply': 0, 'divide': 0},
                 'active_users': 0,
                 'total_requests': 0,
-                'error_count': 0
+                'error_count': 0,
+                'missed_requests': 0
             },
             'historical': TimeSeriesMetrics()
         }
+        # Keep replica stats for as long as the charts show them (2 s per point)
+        self.replica_metrics = ReplicaMetrics(window=self.metrics['historical'].max_points * 2)
         self.calculator_url = "http://calculator-service:5000"
+        self.capture_url = "http://gui-service:5001/capture"
         self.request_counter = 0
         self.last_reset_time = time.time()
 
@@ -68,28 +269,56 @@ class LoadSimulator:
         self.metrics['current']['request_rates'] = {op: 0 for op in self.metrics['current']['request_rates']}
         self.last_reset_time = time.time()
 
+    def user_plan(self, user_id):
+        if self.replay:
+            return replay_plan(self.replay['plan'], user_id, self.active_users, self.replay['loop'])
+        return generate_plan(self.run_seed, user_id)
+
     def start_simulation(self):
         if self.is_running:
             self.stop_simulation()
 
+        self.run_id += 1
+        self.run_seed = self.seed if self.seed is not None else random.SystemRandom().randrange(2 ** 32)
         self.is_running = True
         self.threads = []
 
-        logger.info(f"Starting simulation with {self.active_users} users")
+        if self.replay:
+            logger.info(f"Replaying {len(self.replay['plan'])} captured requests at "
+                        f"{self.replay['speed']}x with {self.active_users} users")
+        else:
+            logger.info(f"Starting simulation with {self.active_users} users (seed {self.run_seed})")
 
+        start_time = time.time()
         for i in range(self.active_users):
-            thread = threading.Thread(target=self.simulate_user, args=(i,))
+            thread = threading.Thread(target=self.simulate_user,
+                                      args=(i, self.user_plan(i), start_time, self.run_id))
             thread.daemon = True
             thread.start()
             self.threads.append(thread)
 
         # Start metrics collection thread
-        metrics_thread = threading.Thread(target=self.collect_metrics)
+        metrics_thread = threading.Thread(target=self.collect_metrics, args=(self.run_id,))
         metrics_thread.daemon = True
         metrics_thread.start()
 
         logger.info("Simulation started successfully")
 
+    def start_replay(self, plan, speed, loop=False):
+        """Replay a plan built by capture_to_plan() (offsets already scaled by `speed`)."""
+        self.replay = {"plan": plan, "speed": speed, "loop": loop}
+        self.start_simulation()
+
+    def plan_info(self):
+        if self.replay:
+            return {
+                "mode": "replay",
+                "requests": len(self.replay['plan']),
+                "speed": self.replay['speed'],
+                "loop": self.replay['loop']
+            }
+        return {"mode": "generated", "seed": self.run_seed}
+
     def stop_simulation(self):
         self.is_running = False
         for thread in self.threads:
@@ -97,57 +326,83 @@ class LoadSimulator:
         self.threads = []
         logger.info("Simulation stopped")
 
-    def simulate_user(self, user_id):
-        operations = ['add', 'subtract', 'multiply', 'divide']
+    def running(self, run_id):
+        return self.is_running and self.run_id == run_id
+
+    def wait_until(self, deadline, run_id):
+        """Sleep until `deadline`, waking up regularly to notice a stop."""
+        while self.running(run_id):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, 0.5))
+        return False
+
+    def simulate_user(self, user_id, plan, start_time, run_id):
+        """Send `plan` on schedule.
+
+        A user that falls behind (e.g. after a slow response) does not burst
+        through its overdue requests: any request more than `max_lag` seconds
+        late is dropped and counted in missed_requests, so the offered load
+        stays the planned one and every run sends at the same instants.
+        """
+        for block in plan:
+            # One conversion per block keeps numpy scalars out of the request loop
+            for offset, op, a, b in block.tolist():
+                if not self.wait_until(start_time + offset, run_id):
+                    return
+                if time.time() - (start_time + offset) > self.max_lag:
+                    self.metrics['current']['missed_requests'] += 1
+                    continue
+                self.send_request(user_id, OPERATIONS[op], a, b)
+
+    def send_request(self, user_id, operation, a, b):
+        try:
+            # Make request to calculator service
+            start_time = time.time()
+            response = requests.post(
+                f"{self.calculator_url}/{operation}",
+                json={"a": a, "b": b},
+                timeout=10
+            )
+            end_time = time.time()
+
+            # Update metrics
+            self.metrics['current']['request_rates'][operation] += 1
+            self.metrics['current']['total_requests'] += 1
+            self.metrics['current']['active_users'] = self.active_users
+            self.replica_metrics.record(
+                response.headers.get('X-Calculator-Replica', 'unknown'),
+                end_time - start_time,
+                response.status_code != 200
+            )
 
-        while self.is_running:
-            try:
-                # Increased delay between requests to reduce load
-                time.sleep(random.uniform(1.0, 3.0))
-
-                # Choose random operation
-                operation = random.choice(operations)
-                a = random.randint(1, 100)
-                b = random.randint(1, 100)
-
-                # Make request to calculator service
-                start_time = time.time()
-                response = requests.post(
-                    f"{self.calculator_url}/{operation}",
-                    json={"a": a, "b": b},
-                    timeout=10
-                )
-                end_time = time.time()
-
-                # Update metrics
-                self.metrics['current']['request_rates'][operation] += 1
-                self.metrics['current']['total_requests'] += 1
-                self.metrics['current']['active_users'] = self.active_users
-
-                if response.status_code != 200:
-                    self.metrics['current']['error_count'] += 1
-                    logger.warning(f"User {user_id} got error response: {response.status_code}")
-                else:
-                    logger.debug(f"User {user_id} successful {operation}: {a}, {b}")
-
-            except requests.exceptions.RequestException as e:
-                self.metrics['current']['error_count'] += 1
-                logger.warning(f"User {user_id} request error: {e}")
-                time.sleep(2)  # Wait longer on errors
-            except Exception as e:
+            if response.status_code != 200:
                 self.metrics['current']['error_count'] += 1
-                logger.error(f"User {user_id} unexpected error: {e}")
-                time.sleep(2)
-
-    def collect_metrics(self):
+                logger.warning(f"User {user_id} got error response: {response.status_code}")
+            else:
+                logger.debug(f"User {user_id} successful {operation}: {a}, {b}")
+
+        except requests.exceptions.RequestException as e:
+            self.metrics['current']['error_count'] += 1
+            self.replica_metrics.record('unknown', None, True)
+            logger.warning(f"User {user_id} request error: {e}")
+        except Exception as e:
+            self.metrics['current']['error_count'] += 1
+            logger.error(f"User {user_id} unexpected error: {e}")
+
+    def collect_metrics(self, run_id):
         """Collect metrics every 2 seconds for historical data"""
-        while self.is_running:
+        while self.running(run_id):
             time.sleep(2)  # Collect every 2 seconds
 
             # Add data point to historical metrics
+            replica_counts = self.replica_metrics.take_interval_counts()
+            replica_counts.pop('unknown', None)
             self.metrics['historical'].add_data_point(
                 self.metrics['current']['request_rates'],
-                self.metrics['current']['active_users']
+                self.metrics['current']['active_users'],
+                replica_counts
             )
 
             # Reset counters for next interval
@@ -164,7 +419,8 @@ def health():
         "status": "healthy",
         "service": "load-simulator",
         "active_users": simulator.active_users,
-        "is_running": simulator.is_running
+        "is_running": simulator.is_running,
+        "plan": simulator.plan_info()
     })
 
 
@@ -172,6 +428,9 @@ def health():
 def get_metrics():
     try:
         current = simulator.metrics['current'].copy()
+        current['replicas'] = simulator.replica_metrics.snapshot()
+        current['replica_imbalance'] = simulator.metrics['historical'].window_imbalance()
+        current['plan'] = simulator.plan_info()
         historical = simulator.metrics['historical'].get_historical_data()
 
         return jsonify({
@@ -196,6 +455,12 @@ def update_load():
         if new_user_count > 50:
             new_user_count = 50
 
+        if 'seed' in data:
+            try:
+                simulator.seed = parse_seed(data['seed'])
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+
         logger.info(f"Updating load to {new_user_count} users")
 
         simulator.active_users = new_user_count
@@ -206,7 +471,8 @@ def update_load():
 
         return jsonify({
             "message": f"Load updated to {new_user_count} users",
-            "user_count": new_user_count
+            "user_count": new_user_count,
+            "plan": simulator.plan_info()
         })
     except Exception as e:
         logger.error(f"Error updating load: {e}")
@@ -216,8 +482,15 @@ def update_load():
 @app.route('/start', methods=['POST'])
 def start_simulation():
     try:
+        data = request.get_json(silent=True) or {}
+        if 'seed' in data:
+            try:
+                simulator.seed = parse_seed(data['seed'])
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+        simulator.replay = None
         simulator.start_simulation()
-        return jsonify({"message": "Simulation started"})
+        return jsonify({"message": "Simulation started", "plan": simulator.plan_info()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -231,8 +504,51 @@ def stop_simulation():
         return jsonify({"error": str(e)}), 500
 
 
-# Initialize the simulator when the app starts
-@app.before_first_request
+@app.route('/replay', methods=['POST'])
+def start_replay():
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            speed = parse_speed(data.get('speed', 1.0))
+            user_count = min(max(int(data.get('user_count', simulator.active_users)), 1), 50)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        loop = data.get('loop', False)
+        if not isinstance(loop, bool):
+            return jsonify({"error": "'loop' must be true or false"}), 400
+
+        capture = data.get('capture')
+        if capture is None:
+            # Default to whatever the GUI has recorded
+            response = requests.get(
+                simulator.capture_url,
+                headers={'X-Admin-Token': os.environ.get('ADMIN_TOKEN', '')},
+                timeout=10
+            )
+            response.raise_for_status()
+            capture = response.json()
+        if not isinstance(capture, dict):
+            return jsonify({"error": "Invalid capture: must be an object"}), 400
+        if not capture.get('offsets'):
+            return jsonify({"error": "Capture is empty"}), 400
+
+        # Validate the whole capture before touching the running simulation
+        plan = capture_to_plan(capture, speed)
+
+        simulator.active_users = user_count
+        simulator.metrics['current']['active_users'] = user_count
+
+        simulator.start_replay(plan, speed, loop)
+        return jsonify({"message": "Replay started", "plan": simulator.plan_info()})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid capture: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Error starting replay: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# Initialize the simulator when the server starts (called from __main__ or the
+# gunicorn post_worker_init hook; before_first_request no longer exists in Flask 2.3)
 def initialize_simulator():
     logger.info("Initializing load simulator")
     # Start with a small delay to ensure other services are ready
@@ -241,4 +557,5 @@ def initialize_simulator():
 
 if __name__ == '__main__':
     logger.info("Starting Load Simulator Service")
+    initialize_simulator()
     app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""Gunicorn settings for the load simulator service.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+GUNICORN_THREADS, GRACEFUL_TIMEOUT and PORT can be overridden from the
+environment.
+"""
+import os
+
+from common.sizing import thread_count
+
+# The simulator keeps its users and metrics in process memory, so it must run a
+# single worker
+workers = 1
+
+# HTTP handlers only read metrics or restart the simulation (the simulated
+# users run on their own threads), so a few threads are enough
+threads = thread_count(default=4)
+worker_class = 'gthread'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Import the app before forking the worker
+preload_app = True
+
+# On SIGTERM stop accepting, let in-flight requests finish, then exit
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 25))
+timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def post_worker_init(worker):
+    # Simulation threads do not survive fork, so start them in the worker
+    from app import initialize_simulator
+    initialize_simulator()